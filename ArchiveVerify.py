@@ -0,0 +1,130 @@
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from DownloadPlan import DownloadPlan, PlanAction, PlanEntry
+from LocalIndex import IndexEntry, LocalIndex, fileFingerprint
+from StatusRenderer import StatusKind, StatusRenderer
+
+
+def hashFile(filepath: str) -> str | None:
+    """
+    sha256 of a file, read via mmap so the page cache is used directly instead of copying into Python buffers.
+    Runs in the worker processes of the verifier. Returns None if the file vanished or cannot be read.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha256().hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return hashlib.sha256(m).hexdigest()
+    except OSError:
+        return None
+
+
+def matchesRecordedHash(entry: IndexEntry, content: bytes) -> bool:
+    """
+    False if a sha256 is recorded for the document and content does not match it.
+    Used before content read from the archive is passed on, so a damaged file never becomes the new reference.
+    """
+    return not entry.sha256 or hashlib.sha256(content).hexdigest() == entry.sha256
+
+
+class VerifyResult:
+    missing: list[IndexEntry]
+    corrupt: list[IndexEntry]
+    orphans: list[str]
+    verified: int
+    unchanged: int
+    recorded: int
+
+    def __init__(self):
+        self.missing = []
+        self.corrupt = []
+        self.orphans = []
+        self.verified = 0
+        self.unchanged = 0
+        self.recorded = 0
+
+    def repairPlan(self, outputDir: str) -> DownloadPlan:
+        """
+        Plan that downloads missing and corrupt documents again to their recorded paths.
+        """
+        entries = []
+        for idx, entry in enumerate(self.missing + self.corrupt):
+            entries.append(PlanEntry(idx, entry.documentId, entry.name, entry.dateCreation, entry.mimeType, PlanAction.redownload, entry.path, message=f"ERNEUT HERUNTERLADEN nach {entry.path}"))
+        return DownloadPlan(outputDir, entries)
+
+
+class ArchiveVerifier:
+    """
+    Compares the local files against the sizes and sha256 hashes recorded in the index.
+    Files whose size, mtime and inode did not change since their last successful check are not read again,
+    so scrubbing an untouched archive only costs one stat per file. All other files are hashed in a process pool.
+    Documents without a recorded hash (downloaded by older versions) get their current hash recorded.
+    """
+
+    def __init__(self, index: LocalIndex, processes: int | None = None):
+        self.index = index
+        self.processes = processes or None
+
+    def verify(self, renderer: StatusRenderer) -> VerifyResult:
+        result = VerifyResult()
+        toHash: list[tuple[int, IndexEntry, list[int]]] = []
+        for idx, entry in enumerate(list(self.index.entries.values())):
+            if not entry.path:
+                # only stored in the object store
+                renderer.advance()
+                continue
+            filepath = self.index.absPath(entry.path)
+            try:
+                if not os.path.isfile(filepath):
+                    raise FileNotFoundError(filepath)
+                fingerprint = fileFingerprint(filepath)
+            except OSError:
+                renderer.advance()
+                renderer.status(idx, entry, StatusKind.error, f"FEHLT - {entry.path}")
+                result.missing.append(entry)
+                continue
+            if entry.sha256 and entry.fingerprint == fingerprint:
+                renderer.advance()
+                result.unchanged += 1
+            elif entry.sha256 and fingerprint[0] != entry.size:
+                renderer.advance()
+                renderer.status(idx, entry, StatusKind.error, f"BESCHÄDIGT - Größe {fingerprint[0]} statt {entry.size}")
+                result.corrupt.append(entry)
+            else:
+                toHash.append((idx, entry, fingerprint))
+
+        if toHash:
+            try:
+                self.__hashAll(toHash, renderer, result)
+            finally:
+                # Keep the hashes recorded so far, even if the scrub is aborted
+                self.index.save()
+
+        result.orphans = self.index.findUnindexedFiles()
+        return result
+
+    def __hashAll(self, toHash: list[tuple[int, IndexEntry, list[int]]], renderer: StatusRenderer, result: VerifyResult):
+        with ProcessPoolExecutor(max_workers=self.processes) as pool:
+            paths = [self.index.absPath(entry.path) for _, entry, _ in toHash]
+            for (idx, entry, fingerprint), sha256 in zip(toHash, pool.map(hashFile, paths, chunksize=16)):
+                renderer.advance()
+                if sha256 is None:
+                    # vanished or unreadable since it was listed
+                    renderer.status(idx, entry, StatusKind.error, f"FEHLT - {entry.path} nicht lesbar")
+                    entry.fingerprint = None
+                    result.missing.append(entry)
+                elif not entry.sha256:
+                    entry.sha256 = sha256
+                    entry.size = fingerprint[0]
+                    entry.fingerprint = fingerprint
+                    result.recorded += 1
+                elif entry.sha256 == sha256 and entry.size == fingerprint[0]:
+                    entry.fingerprint = fingerprint
+                    result.verified += 1
+                else:
+                    renderer.status(idx, entry, StatusKind.error, "BESCHÄDIGT - Prüfsumme weicht ab")
+                    entry.fingerprint = None
+                    result.corrupt.append(entry)
@@ -3,6 +3,7 @@ import requests
 import json
 import secrets
 from datetime import datetime
+from Transport import Transport
 
 baseUrl = "https://api.comdirect.de/"
 
@@ -86,8 +87,11 @@ class Connection:
     password: str
     sessionId: str = secrets.token_urlsafe(32)  # length must be <= 32
     requestId: str = datetime.now().strftime("%H%M%S%f")[:-3]  # length must be == 9
+    transport: Transport
 
-    def __init__(self, client_id: str, client_secret: str, username: str, password: str):
+    def __init__(self, client_id: str, client_secret: str, username: str, password: str, transport: Transport | None = None):
+        # The transport sends all requests; it may record them to or replay them from a cassette
+        self.transport = transport or Transport()
         self.client_id = client_id
         self.client_secret = client_secret
         self.username = username
@@ -121,7 +125,7 @@ class Connection:
         return headers
 
     def __getOAuth(self):
-        r = requests.post(
+        r = self.transport.post(
             baseUrl + "oauth/token",
             data={
                 "client_id": self.client_id,
@@ -153,7 +157,7 @@ class Connection:
         Retrieve the current session, initializes if not existing.
         """
         headers = self.__getHeaders("application/x-www-form-urlencoded")
-        r = requests.get(baseUrl + "api/session/clients/user/v1/sessions", headers=headers)
+        r = self.transport.get(baseUrl + "api/session/clients/user/v1/sessions", headers=headers)
         if r.status_code == 200:
             self.sessionApiId = r.json()[0]["identifier"]
         r.raise_for_status()
@@ -164,7 +168,7 @@ class Connection:
         POST a TAN Challenge. This will trigger a validation request that needs to be fulfilled with a valid TAN.
         WARNING: More than 5 failed/unverified attempts will lead the banking access to be locked and requires unlocking by customer support!!!
         """
-        r = requests.post(
+        r = self.transport.post(
             baseUrl + "api/session/clients/user/v1/sessions/" + self.sessionApiId + "/validate",
             json={
                 "identifier": self.sessionApiId,
@@ -186,7 +190,7 @@ class Connection:
         if challenge_tan != "":
             headers["x-once-authentication"] = challenge_tan
 
-        r = requests.patch(
+        r = self.transport.patch(
             baseUrl + "api/session/clients/user/v1/sessions/" + self.sessionApiId,
             json={
                 "identifier": self.sessionApiId,
@@ -198,7 +202,7 @@ class Connection:
         return r
 
     def getCDSecondary(self):
-        r = requests.post(
+        r = self.transport.post(
             baseUrl + "oauth/token",
             headers={
                 "Accept": "application/json",
@@ -230,7 +234,7 @@ class Connection:
         return r
 
     def refresh(self):
-        r = requests.post(
+        r = self.transport.post(
             baseUrl + "oauth/token",
             headers={
                 "Accept": "application/json",
@@ -251,7 +255,7 @@ class Connection:
         r.raise_for_status()
 
     def revoke(self):
-        r = requests.delete(
+        r = self.transport.delete(
             baseUrl + "oatuh/revoke",
             headers={
                 "Accept": "application/json",
@@ -275,7 +279,7 @@ class Connection:
                 }
             ),
         }
-        r = requests.get(
+        r = self.transport.get(
             baseUrl + "api/messages/clients/user/v2/documents?paging-first=" + str(start) + "&paging-count=" + str(count),
             headers=headers,
         )
@@ -283,10 +287,13 @@ class Connection:
         return DocumentList(r.json())
 
     def downloadDocument(self, document: Document):
-        r = requests.get(
-            f"{baseUrl}api/messages/v2/documents/{document.documentId}",
+        return self.downloadDocumentById(document.documentId, document.mimeType)
+
+    def downloadDocumentById(self, documentId: str, mimeType: str):
+        r = self.transport.get(
+            f"{baseUrl}api/messages/v2/documents/{documentId}",
             headers={
-                "Accept": document.mimeType,
+                "Accept": mimeType,
                 "Content-Type": "application/x-www-form-urlencoded",
                 "Authorization": "Bearer " + self.access_token,
                 "x-http-request-info": str(
@@ -304,5 +311,5 @@ class Connection:
             return r.content
         except requests.exceptions.HTTPError as e:
             # Return None on HTTP errors (including 500) to allow the process to continue
-            print(f"HTTP Error {r.status_code} for document {document.documentId}: {str(e)}")
+            print(f"HTTP Error {r.status_code} for document {documentId}: {str(e)}")
             return None
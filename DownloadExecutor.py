@@ -0,0 +1,149 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ArchiveVerify import matchesRecordedHash
+from ComdirectConnection import Connection
+from DownloadPlan import DownloadPlan, PlanAction, PlanEntry, fileExtensionForMimeType
+from LocalIndex import IndexEntry, LocalIndex, fileFingerprint
+from OutputSink import LocalSink, ObjectStoreSink
+from StatusRenderer import StatusKind, StatusRenderer
+
+
+def isFileEqual(filepath: str, newdata: bytes):
+    if os.path.getsize(filepath) != len(newdata):
+        return False
+    with open(filepath, "rb") as f:
+        return f.read() == newdata
+
+
+class DownloadExecutor:
+    """
+    Carries out a DownloadPlan with several parallel downloads.
+    Execution is idempotent: documents that are already stored according to the index are skipped,
+    files are written atomically and the index is updated as downloads finish.
+    Downloaded content is handed from memory to the local sink and/or the object store sink.
+    """
+    # Save the index every n finished downloads, so an aborted run loses little progress
+    saveIndexEvery: int = 50
+
+    def __init__(self, conn: Connection | None, index: LocalIndex, threads: int = 4, localSink: LocalSink | None = None, objectSink: ObjectStoreSink | None = None):
+        self.conn = conn
+        self.index = index
+        self.threads = max(1, threads)
+        # Without any sink given, documents are stored locally
+        self.localSink = localSink if localSink or objectSink else LocalSink(index)
+        self.objectSink = objectSink
+
+    def execute(self, plan: DownloadPlan, renderer: StatusRenderer, dryRun: bool = False) -> dict[str, int]:
+        counts = {"total": len(plan.entries), "processed": 0, "downloaded": 0, "skipped": 0}
+        pending: list[PlanEntry] = []
+        for entry in plan.entries:
+            if entry.action != PlanAction.skipFiltered and not fileExtensionForMimeType(entry.mimeType):
+                # stored without file extension
+                renderer.status(entry.idx, entry, StatusKind.info, f"Unknown mimeType {entry.mimeType}")
+            if entry.needsExecution() and not dryRun:
+                pending.append(entry)
+                continue
+            renderer.advance()
+            counts["processed"] += 1
+            if entry.needsExecution():
+                renderer.status(entry.idx, entry, StatusKind.downloaded, f"TESTLAUF - {entry.message}")
+                counts["downloaded"] += 1
+            else:
+                renderer.status(entry.idx, entry, StatusKind.skipped, entry.message)
+                counts["skipped"] += 1
+
+        if not pending:
+            return counts
+
+        unsaved = 0
+        with ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = {pool.submit(self.__executeEntry, entry): entry for entry in pending}
+            try:
+                for future in as_completed(futures):
+                    entry = futures[future]
+                    try:
+                        kind, message, indexEntry = future.result()
+                    except OSError as error:
+                        # A single unwritable or vanished file must not stop the whole plan
+                        kind, message, indexEntry = StatusKind.error, f"FEHLER - {error}", None
+                    renderer.advance()
+                    renderer.status(entry.idx, entry, kind, message)
+                    counts["processed"] += 1
+                    if kind == StatusKind.downloaded:
+                        counts["downloaded"] += 1
+                    else:
+                        counts["skipped"] += 1
+                    if indexEntry:
+                        self.index.set(indexEntry)
+                        unsaved += 1
+                        if unsaved >= self.saveIndexEvery:
+                            self.index.save()
+                            unsaved = 0
+            finally:
+                for future in futures:
+                    future.cancel()
+                self.index.save()
+        return counts
+
+    def __executeEntry(self, entry: PlanEntry) -> tuple[StatusKind, str, IndexEntry | None]:
+        if entry.action == PlanAction.upload:
+            if not self.objectSink:
+                return StatusKind.error, "FEHLER - Kein Object Store eingerichtet, Hochladen nicht möglich", None
+            # Backfill of a document that was stored locally before the object store was configured
+            with open(self.index.absPath(entry.path), "rb") as f:
+                docContent = f.read()
+            known = self.index.get(entry.documentId)
+            if known and not matchesRecordedHash(known, docContent):
+                # keep the recorded hash, so the archive verification still reports the file as corrupt
+                return StatusKind.error, "FEHLER - Prüfsumme weicht ab, nicht hochgeladen (Archiv prüfen)", None
+            return self.__storeObject(entry, entry.path, docContent, "HOCHGELADEN")
+
+        if entry.action == PlanAction.redownload:
+            docContent = self.conn.downloadDocumentById(entry.documentId, entry.mimeType)
+            if docContent is None:
+                return StatusKind.error, "FEHLER - Download fehlgeschlagen (siehe oben)", None
+            LocalSink(self.index).store(entry, docContent)
+            return self.__storeObject(entry, entry.path, docContent, "ERNEUT HERUNTERGELADEN")
+
+        if self.localSink and self.index.isStored(entry.documentId) or not self.localSink and self.index.isUploaded(entry.documentId):
+            return StatusKind.skipped, "ÜBERSPRUNGEN - Datei bereits heruntergeladen", None
+
+        docContent = self.conn.downloadDocumentById(entry.documentId, entry.mimeType)
+        if docContent is None:
+            return StatusKind.error, "FEHLER - Download fehlgeschlagen (siehe oben)", None
+        if not self.localSink:
+            return self.__storeObject(entry, "", docContent, "HERUNTERGELADEN und HOCHGELADEN")
+
+        for path in entry.compareWith:
+            if os.path.isfile(self.index.absPath(path)) and isFileEqual(self.index.absPath(path), docContent):
+                return self.__storeObject(entry, path, docContent, "ÜBERSPRUNGEN - Datei bereits heruntergeladen", StatusKind.skipped)
+
+        filepath = self.index.absPath(entry.path)
+        if os.path.exists(filepath):
+            # Left over from an aborted run before the index was saved?
+            if isFileEqual(filepath, docContent):
+                return self.__storeObject(entry, entry.path, docContent, "ÜBERSPRUNGEN - Datei bereits heruntergeladen", StatusKind.skipped)
+            return StatusKind.error, f"FEHLER - {entry.path} existiert bereits, Downloadplan ist veraltet", None
+
+        self.localSink.store(entry, docContent)
+        return self.__storeObject(entry, entry.path, docContent, "HERUNTERGELADEN")
+
+    def __storeObject(self, entry: PlanEntry, path: str, docContent: bytes, message: str, kind: StatusKind = StatusKind.downloaded) -> tuple[StatusKind, str, IndexEntry | None]:
+        """
+        Uploads the content if an object store is configured and it is not uploaded yet, and returns the final status with the new index entry.
+        """
+        known = self.index.get(entry.documentId)
+        # The content is in memory anyway; recording hash and file fingerprint lets the scrub skip this file until it changes
+        indexEntry = IndexEntry(entry.documentId, path, entry.name, entry.dateCreation, entry.mimeType, len(docContent), known.objectKey if known else "", hashlib.sha256(docContent).hexdigest())
+        if path:
+            indexEntry.fingerprint = fileFingerprint(self.index.absPath(path))
+        if self.objectSink and not indexEntry.objectKey:
+            try:
+                indexEntry.objectKey = self.objectSink.store(entry, docContent)
+            except Exception as error:
+                # If there is a local copy, the upload is retried on the next run
+                return StatusKind.error, f"FEHLER - Upload fehlgeschlagen: {error}", indexEntry if path else None
+            if kind == StatusKind.skipped:
+                kind, message = StatusKind.downloaded, "HOCHGELADEN"
+        return kind, message, indexEntry
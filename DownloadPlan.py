@@ -0,0 +1,296 @@
+import json
+import os
+import sys
+from datetime import datetime
+from enum import Enum
+from typing import Callable
+from pathvalidate._filename import sanitize_filename
+from ComdirectConnection import Document
+from LocalIndex import LocalIndex
+
+
+class DownloadSource(Enum):
+    archivedOnly = "archivedOnly"
+    notArchivedOnly = "notArchivedOnly"
+    all = "all"
+
+
+class PlanAction(Enum):
+    download = "download"
+    # Download, but first compare the content against local files which are not in the index yet.
+    downloadIfDifferent = "downloadIfDifferent"
+    # Already stored locally, only the upload to the object store is missing
+    upload = "upload"
+    # Replace a missing or corrupt local file, found by the archive verification
+    redownload = "redownload"
+    skipExisting = "skipExisting"
+    skipFiltered = "skipFiltered"
+
+
+class PlanEntry:
+    """
+    The final decision for a single online document. All paths are relative to the output directory and use "/".
+    """
+    idx: int
+    documentId: str
+    name: str
+    dateCreation: datetime
+    mimeType: str
+    action: PlanAction
+    path: str
+    compareWith: list[str]
+    message: str
+
+    def __init__(self, idx: int, documentId: str, name: str, dateCreation: datetime, mimeType: str, action: PlanAction, path: str = "", compareWith: list[str] | None = None, message: str = ""):
+        self.idx = idx
+        self.documentId = documentId
+        self.name = name
+        self.dateCreation = dateCreation
+        self.mimeType = mimeType
+        self.action = action
+        self.path = path
+        self.compareWith = compareWith or []
+        self.message = message
+
+    @classmethod
+    def fromDict(cls, data: dict[str, object]):
+        return cls(
+            data["idx"],
+            data["documentId"],
+            data["name"],
+            datetime.strptime(data["dateCreation"], "%Y-%m-%d"),
+            data["mimeType"],
+            PlanAction(data["action"]),
+            data["path"],
+            data["compareWith"],
+            data["message"],
+        )
+
+    def toDict(self) -> dict[str, object]:
+        return {
+            "idx": self.idx,
+            "documentId": self.documentId,
+            "name": self.name,
+            "dateCreation": self.dateCreation.strftime("%Y-%m-%d"),
+            "mimeType": self.mimeType,
+            "action": self.action.value,
+            "path": self.path,
+            "compareWith": self.compareWith,
+            "message": self.message,
+        }
+
+    def needsDownload(self) -> bool:
+        return self.action in [PlanAction.download, PlanAction.downloadIfDifferent, PlanAction.redownload]
+
+    def needsExecution(self) -> bool:
+        return self.needsDownload() or self.action == PlanAction.upload
+
+
+class DownloadPlan:
+    outputDir: str
+    created: datetime
+    entries: list[PlanEntry]
+
+    def __init__(self, outputDir: str, entries: list[PlanEntry], created: datetime | None = None):
+        self.outputDir = outputDir
+        self.entries = entries
+        self.created = created or datetime.now()
+
+    @classmethod
+    def load(cls, planFile: str):
+        with open(planFile, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["outputDir"], [PlanEntry.fromDict(x) for x in data["entries"]], datetime.fromisoformat(data["created"]))
+
+    def save(self, planFile: str):
+        tmpFile = planFile + ".part"
+        with open(tmpFile, "w", encoding="utf-8") as f:
+            json.dump({
+                "version": 1,
+                "outputDir": self.outputDir,
+                "created": self.created.isoformat(timespec="seconds"),
+                "entries": [entry.toDict() for entry in self.entries],
+            }, f, ensure_ascii=False, indent=1)
+        os.replace(tmpFile, planFile)
+
+    def count(self, action: PlanAction) -> int:
+        return sum(1 for entry in self.entries if entry.action == action)
+
+
+def fileExtensionForMimeType(mimeType: str) -> str:
+    if mimeType == "application/pdf":
+        return "pdf"
+    elif mimeType == "text/html":
+        return "html"
+    return ""
+
+
+def appendToFilename(path: str, suffix: str) -> str:
+    base, ext = os.path.splitext(path)
+    return f"{base}_{suffix}{ext}"
+
+
+def legacyFolderLayout(useSubFolders: bool) -> str:
+    return "{format}" if useSubFolders else ""
+
+
+def layoutFolder(folderLayout: str, name: str, dateCreation: datetime, mimeType: str) -> str:
+    """
+    Fills the placeholders of folderLayout, e.g. "{year}/{month}" or "{type}/{year}".
+    Empty segments and "." or ".." are dropped, so the folder always stays below the output directory.
+    """
+    values = {
+        "year": dateCreation.strftime("%Y"),
+        "month": dateCreation.strftime("%m"),
+        "day": dateCreation.strftime("%d"),
+        "type": name.split(" ", 1)[0],
+        "format": fileExtensionForMimeType(mimeType),
+    }
+    segments = []
+    for segment in folderLayout.replace("\\", "/").split("/"):
+        try:
+            segment = segment.format_map(values)
+        except (KeyError, ValueError) as error:
+            raise NameError(f"Invalid folderLayout {folderLayout}: {error}")
+        segment = sanitize_filename(segment)
+        if segment and segment not in (".", ".."):
+            segments.append(segment)
+    return "/".join(segments)
+
+
+def pathKey(path: str) -> str:
+    """
+    Key under which two paths name the same file. normcase folds case on Windows only,
+    but the default file systems of macOS are case-insensitive as well.
+    """
+    path = os.path.normcase(path)
+    return path.casefold() if sys.platform == "darwin" else path
+
+
+class TargetPathResolver:
+    """
+    Assigns collision free paths below the output directory in the order documents are resolved.
+    Files on disk are listed once per directory; paths handed out earlier count as occupied.
+    """
+
+    def __init__(self, outputDir: str, folderLayout: str, appendIfNameExists: bool, ignorePath: Callable[[str], bool] | None = None):
+        self.outputDir = outputDir
+        self.folderLayout = folderLayout
+        self.appendIfNameExists = appendIfNameExists
+        # Files on disk for which ignorePath returns True are treated as free
+        self.ignorePath = ignorePath
+        # keyed by pathKey, so names that only differ in case collide where the file system treats them as one file
+        self.reserved: dict[str, float] = {}
+        self.__dirListings: dict[str, dict[str, tuple[str, float]]] = {}
+
+    def relativeTargetPath(self, name: str, dateCreation: datetime, mimeType: str) -> str:
+        ext = fileExtensionForMimeType(mimeType)
+        filename = sanitize_filename(f"{name}.{ext}" if ext else name)
+        folder = layoutFolder(self.folderLayout, name, dateCreation, mimeType)
+        return f"{folder}/{filename}" if folder else filename
+
+    def resolve(self, name: str, dateCreation: datetime, mimeType: str) -> tuple[str | None, list[str]]:
+        """
+        Returns the reserved path, or None if the name is taken and appendIfNameExists is off,
+        and the files on disk which occupied one of the candidate names.
+        """
+        docDate = dateCreation.timestamp()
+        path = self.relativeTargetPath(name, dateCreation, mimeType)
+        occupiedOnDisk = []
+        mtime = self.occupiedMtime(path)
+        if mtime is not None:
+            if not self.appendIfNameExists:
+                return None, []
+            if mtime != docDate:  # If not the same, we simply append the date
+                path = appendToFilename(path, dateCreation.strftime("%Y-%m-%d"))
+            # If there's multiple per same day, we append a counter
+            basePath = path
+            counter = 1
+            while self.occupiedMtime(path) is not None:
+                onDisk = self.__onDisk(path)
+                if pathKey(path) not in self.reserved and onDisk:
+                    occupiedOnDisk.append(onDisk[0])
+                path = appendToFilename(basePath, str(counter))
+                counter += 1
+        self.reserved[pathKey(path)] = docDate
+        return path, occupiedOnDisk
+
+    def occupiedMtime(self, path: str) -> float | None:
+        if pathKey(path) in self.reserved:
+            return self.reserved[pathKey(path)]
+        onDisk = self.__onDisk(path)
+        if onDisk is None or self.ignorePath and self.ignorePath(onDisk[0]):
+            return None
+        return onDisk[1]
+
+    def __onDisk(self, path: str) -> tuple[str, float] | None:
+        """
+        Path as spelled on disk and mtime of the file occupying path, if any.
+        """
+        relDir, _, filename = path.rpartition("/")
+        return self.__listDir(relDir).get(pathKey(filename))
+
+    def __listDir(self, relDir: str) -> dict[str, tuple[str, float]]:
+        if pathKey(relDir) not in self.__dirListings:
+            listing = {}
+            absDir = os.path.join(self.outputDir, *relDir.split("/"))
+            if os.path.isdir(absDir):
+                with os.scandir(absDir) as it:
+                    for dirEntry in it:
+                        if dirEntry.is_file():
+                            listing[pathKey(dirEntry.name)] = (f"{relDir}/{dirEntry.name}" if relDir else dirEntry.name, dirEntry.stat().st_mtime)
+            self.__dirListings[pathKey(relDir)] = listing
+        return self.__dirListings[pathKey(relDir)]
+
+
+class DownloadPlanner:
+    """
+    Resolves every online document to its final action and target path before anything is downloaded.
+    The result only depends on the document list, the local index and the files present when planning,
+    so it can be executed in parallel and a dry run shows exactly what will happen.
+    """
+
+    def __init__(self, index: LocalIndex, folderLayout: str, appendIfNameExists: bool, downloadOnlyFilenames: bool, downloadFilenameList: str, downloadSource: str, storeLocal: bool = True, storeObject: bool = False):
+        self.index = index
+        self.storeLocal = storeLocal
+        self.storeObject = storeObject
+        self.folderLayout = folderLayout
+        self.appendIfNameExists = appendIfNameExists
+        self.downloadOnlyFilenames = downloadOnlyFilenames
+        self.downloadFilenameList = downloadFilenameList
+        self.downloadSource = downloadSource
+
+    def plan(self, documents: dict[int, Document]) -> DownloadPlan:
+        resolver = TargetPathResolver(self.index.outputDir, self.folderLayout, self.appendIfNameExists)
+        entries = [self.__planDocument(resolver, idx, documents[idx]) for idx in documents]
+        return DownloadPlan(self.index.outputDir, entries)
+
+    def __planDocument(self, resolver: TargetPathResolver, idx: int, document: Document) -> PlanEntry:
+        def entry(action: PlanAction, path: str = "", compareWith: list[str] | None = None, message: str = ""):
+            return PlanEntry(idx, document.documentId, document.name, document.dateCreation, document.mimeType, action, path, compareWith, message)
+
+        firstFilename = document.name.split(" ", 1)[0]
+        if self.downloadSource == DownloadSource.archivedOnly.value and not document.documentMetadata.archived or self.downloadSource == DownloadSource.notArchivedOnly.value and document.documentMetadata.archived:
+            return entry(PlanAction.skipFiltered, message="SKIPPED - not in selected download source")
+        if self.downloadOnlyFilenames and not firstFilename in self.downloadFilenameList:
+            return entry(PlanAction.skipFiltered, message="SKIPPED - filename not in filename list")
+
+        isUploaded = not self.storeObject or self.index.isUploaded(document.documentId)
+        if self.index.isStored(document.documentId):
+            path = self.index.get(document.documentId).path
+            if isUploaded:
+                return entry(PlanAction.skipExisting, path, message="ÜBERSPRUNGEN - Datei bereits heruntergeladen")
+            return entry(PlanAction.upload, path, message=f"HOCHLADEN von {path}")
+        if not self.storeLocal:
+            if isUploaded:
+                return entry(PlanAction.skipExisting, message="ÜBERSPRUNGEN - Dokument bereits hochgeladen")
+            return entry(PlanAction.download, message="HERUNTERLADEN und HOCHLADEN")
+
+        path, occupiedOnDisk = resolver.resolve(document.name, document.dateCreation, document.mimeType)
+        if path is None:
+            return entry(PlanAction.skipExisting, resolver.relativeTargetPath(document.name, document.dateCreation, document.mimeType), message="ÜBERSPRUNGEN - appendIfNameExists ist FALSE")
+        # Local files not known to the index may be this very document and are compared during execution
+        compareWith = [x for x in occupiedOnDisk if self.index.ownerOfPath(x) is None]
+        if compareWith:
+            return entry(PlanAction.downloadIfDifferent, path, compareWith, f"HERUNTERLADEN nach {path}, falls nicht identisch mit {', '.join(compareWith)}")
+        return entry(PlanAction.download, path, message=f"HERUNTERLADEN nach {path}")
@@ -0,0 +1,143 @@
+import json
+import os
+from datetime import datetime
+
+indexFileName = ".comdirect-index.json"
+
+
+class IndexEntry:
+    """
+    A document that is known to be stored. `path` is relative to the output directory and always uses "/";
+    it is empty if the document was only uploaded to the object store (`objectKey`).
+    """
+    documentId: str
+    path: str
+    name: str
+    dateCreation: datetime
+    mimeType: str
+    size: int
+    objectKey: str
+    sha256: str
+    # size, mtime (ns) and inode of the file when sha256 was last checked
+    fingerprint: list[int] | None
+
+    def __init__(self, documentId: str, path: str, name: str, dateCreation: datetime, mimeType: str, size: int, objectKey: str = "", sha256: str = "", fingerprint: list[int] | None = None):
+        self.documentId = documentId
+        self.path = path
+        self.name = name
+        self.dateCreation = dateCreation
+        self.mimeType = mimeType
+        self.size = size
+        self.objectKey = objectKey
+        self.sha256 = sha256
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def fromDict(cls, documentId: str, data: dict[str, object]):
+        return cls(
+            documentId,
+            data["path"],
+            data["name"],
+            datetime.strptime(data["dateCreation"], "%Y-%m-%d"),
+            data["mimeType"],
+            data["size"],
+            data.get("objectKey", ""),
+            data.get("sha256", ""),
+            data.get("fingerprint"),
+        )
+
+    def toDict(self) -> dict[str, object]:
+        data = {
+            "path": self.path,
+            "name": self.name,
+            "dateCreation": self.dateCreation.strftime("%Y-%m-%d"),
+            "mimeType": self.mimeType,
+            "size": self.size,
+        }
+        if self.objectKey:
+            data["objectKey"] = self.objectKey
+        if self.sha256:
+            data["sha256"] = self.sha256
+        if self.fingerprint:
+            data["fingerprint"] = self.fingerprint
+        return data
+
+
+def fileFingerprint(filepath: str) -> list[int]:
+    stat = os.stat(filepath)
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def isInternalFile(path: str) -> bool:
+    return path.rpartition("/")[2].startswith(".comdirect-") or path.endswith(".part")
+
+
+class LocalIndex:
+    """
+    Maps documentIds to the files in the output directory, so already downloaded documents
+    are recognized by id instead of by name and modification time.
+    """
+    outputDir: str
+    entries: dict[str, IndexEntry]
+
+    def __init__(self, outputDir: str):
+        self.outputDir = outputDir
+        self.indexFile = os.path.join(outputDir, indexFileName)
+        self.entries = {}
+        self.__pathOwners: dict[str, str] = {}
+        if os.path.isfile(self.indexFile):
+            with open(self.indexFile, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            for documentId, entryData in data["documents"].items():
+                self.set(IndexEntry.fromDict(documentId, entryData))
+
+    def save(self):
+        tmpFile = self.indexFile + ".part"
+        with open(tmpFile, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "documents": {documentId: entry.toDict() for documentId, entry in self.entries.items()}}, f, ensure_ascii=False)
+        os.replace(tmpFile, self.indexFile)
+
+    def get(self, documentId: str) -> IndexEntry | None:
+        return self.entries.get(documentId)
+
+    def set(self, entry: IndexEntry):
+        self.remove(entry.documentId)
+        self.entries[entry.documentId] = entry
+        if entry.path:
+            self.__pathOwners[entry.path] = entry.documentId
+
+    def remove(self, documentId: str):
+        entry = self.entries.pop(documentId, None)
+        if entry and self.__pathOwners.get(entry.path) == documentId:
+            del self.__pathOwners[entry.path]
+
+    def ownerOfPath(self, path: str) -> str | None:
+        return self.__pathOwners.get(path)
+
+    def absPath(self, path: str) -> str:
+        return os.path.join(self.outputDir, *path.split("/"))
+
+    def isStored(self, documentId: str) -> bool:
+        entry = self.get(documentId)
+        return entry is not None and entry.path != "" and os.path.isfile(self.absPath(entry.path))
+
+    def isUploaded(self, documentId: str) -> bool:
+        entry = self.get(documentId)
+        return entry is not None and entry.objectKey != ""
+
+    def listFiles(self) -> list[str]:
+        """
+        All document files below the output directory as relative paths with "/", without the files of this tool.
+        """
+        files = []
+        for root, dirs, filenames in os.walk(self.outputDir):
+            dirs[:] = [x for x in dirs if not x.startswith(".comdirect-")]
+            relDir = os.path.relpath(root, self.outputDir).replace(os.sep, "/")
+            for filename in filenames:
+                path = filename if relDir == "." else f"{relDir}/{filename}"
+                if not isInternalFile(path):
+                    files.append(path)
+        return files
+
+    def findUnindexedFiles(self) -> list[str]:
+        return [x for x in self.listFiles() if self.ownerOfPath(x) is None]
@@ -0,0 +1,83 @@
+import io
+import os
+from enum import Enum
+from urllib.parse import quote
+from DownloadPlan import PlanEntry, fileExtensionForMimeType
+from LocalIndex import LocalIndex
+
+
+class SinkMode(Enum):
+    local = "local"
+    s3 = "s3"
+    both = "both"
+
+
+class LocalSink:
+    """
+    Writes documents below the output directory. Files are written to a temporary name first and then renamed,
+    so an aborted run never leaves a truncated document under its final name.
+    """
+
+    def __init__(self, index: LocalIndex):
+        self.index = index
+
+    def store(self, entry: PlanEntry, docContent: bytes):
+        filepath = self.index.absPath(entry.path)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        tmpFile = filepath + ".part"
+        with open(tmpFile, "wb") as f:
+            f.write(docContent)
+        docDate = entry.dateCreation.timestamp()
+        os.utime(tmpFile, (docDate, docDate))
+        os.replace(tmpFile, filepath)
+
+
+class ObjectStoreSink:
+    """
+    Uploads documents straight from memory to an S3 compatible object store (AWS S3, MinIO, ...).
+    Objects are keyed by documentId; large documents are uploaded as concurrent multipart uploads.
+    """
+
+    def __init__(self, endpoint: str, bucket: str, accessKey: str, secretKey: str, region: str = "", prefix: str = "", uploadThreads: int = 4, multipartChunkMB: int = 8):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint or None,
+            region_name=region or None,
+            aws_access_key_id=accessKey,
+            aws_secret_access_key=secretKey,
+        )
+        chunkSize = multipartChunkMB * 1024 * 1024
+        self.transferConfig = TransferConfig(
+            multipart_threshold=chunkSize,
+            multipart_chunksize=chunkSize,
+            max_concurrency=max(1, uploadThreads),
+            use_threads=True,
+        )
+
+    def objectKey(self, documentId: str, mimeType: str) -> str:
+        ext = fileExtensionForMimeType(mimeType)
+        return f"{self.prefix}{documentId}.{ext}" if ext else f"{self.prefix}{documentId}"
+
+    def store(self, entry: PlanEntry, docContent: bytes) -> str:
+        key = self.objectKey(entry.documentId, entry.mimeType)
+        self.client.upload_fileobj(
+            io.BytesIO(docContent),
+            self.bucket,
+            key,
+            ExtraArgs={
+                "ContentType": entry.mimeType,
+                # Metadata has to be ASCII
+                "Metadata": {
+                    "documentid": entry.documentId,
+                    "name": quote(entry.name),
+                    "datecreation": entry.dateCreation.strftime("%Y-%m-%d"),
+                },
+            },
+            Config=self.transferConfig,
+        )
+        return key
@@ -0,0 +1,245 @@
+import os
+import re
+import shutil
+from datetime import datetime
+from enum import Enum
+from ComdirectConnection import Connection, Document
+from DownloadPlan import TargetPathResolver, fileExtensionForMimeType, pathKey
+from DownloadExecutor import isFileEqual
+from LocalIndex import IndexEntry, LocalIndex
+from pathvalidate._filename import sanitize_filename
+
+class RelayoutMode(Enum):
+    move = "move"
+    hardlink = "hardlink"
+
+
+class ArchiveMatcher:
+    """
+    Assigns local files that are not in the index yet to their online documents.
+    Files are matched by name (including the date and counter suffixes appended on collisions) and date.
+    Only if several documents of the same name and day remain, their content is downloaded and compared.
+    """
+    suffixPattern = re.compile(r"^(?P<base>.*?)(?:_(?P<date>\d{4}-\d{2}-\d{2}))?(?:_\d+)?$")
+
+    def __init__(self, index: LocalIndex, conn: Connection | None):
+        self.index = index
+        self.conn = conn
+
+    def match(self, documents: dict[int, Document], unindexedFiles: list[str]) -> int:
+        filesByKey: dict[tuple[str, str], list[str]] = {}
+        for path in unindexedFiles:
+            for key in self.__keysForFile(path):
+                filesByKey.setdefault(key, []).append(path)
+
+        documentsByKey: dict[tuple[str, str], list[Document]] = {}
+        for idx in documents:
+            document = documents[idx]
+            if self.index.get(document.documentId):
+                continue
+            ext = fileExtensionForMimeType(document.mimeType)
+            filename = sanitize_filename(f"{document.name}.{ext}" if ext else document.name)
+            key = (filename, document.dateCreation.strftime("%Y-%m-%d"))
+            documentsByKey.setdefault(key, []).append(document)
+
+        claimed: set[str] = set()
+        matched = 0
+        for key, keyDocuments in documentsByKey.items():
+            candidates = [x for x in filesByKey.get(key, []) if x not in claimed]
+            if not candidates:
+                continue
+            if len(keyDocuments) == 1 and len(candidates) == 1:
+                pairs = [(keyDocuments[0], candidates[0])]
+            else:
+                pairs = self.__matchByContent(keyDocuments, candidates)
+            for document, path in pairs:
+                claimed.add(path)
+                self.index.set(IndexEntry(document.documentId, path, document.name, document.dateCreation, document.mimeType, os.path.getsize(self.index.absPath(path))))
+                matched += 1
+        return matched
+
+    def __keysForFile(self, path: str) -> set[tuple[str, str]]:
+        """
+        (filename as it was before appending suffixes, date of the document) for every plausible reading of the filename.
+        """
+        filename = path.rpartition("/")[2]
+        stem, ext = os.path.splitext(filename)
+        mtimeDate = datetime.fromtimestamp(os.path.getmtime(self.index.absPath(path))).strftime("%Y-%m-%d")
+        keys = {(filename, mtimeDate)}
+        m = self.suffixPattern.match(stem)
+        if m and m.group("base"):
+            keys.add((m.group("base") + ext, m.group("date") or mtimeDate))
+        # "_1" alone may also be the counter directly behind the name
+        counterStripped = re.sub(r"_\d+$", "", stem)
+        if counterStripped and counterStripped != stem:
+            keys.add((counterStripped + ext, mtimeDate))
+        return keys
+
+    def __matchByContent(self, documents: list[Document], candidates: list[str]) -> list[tuple[Document, str]]:
+        if not self.conn:
+            return []
+        pairs = []
+        remaining = list(candidates)
+        for document in documents:
+            docContent = self.conn.downloadDocumentById(document.documentId, document.mimeType)
+            if docContent is None:
+                continue
+            for path in remaining:
+                if isFileEqual(self.index.absPath(path), docContent):
+                    pairs.append((document, path))
+                    remaining.remove(path)
+                    break
+        return pairs
+
+
+class Relayout:
+    """
+    Moves or hardlinks all indexed documents from the source archive into the layout of the target directory.
+    Only local file operations are used.
+    """
+    # Save the index every n moved files
+    saveIndexEvery: int = 200
+
+    def __init__(self, sourceIndex: LocalIndex, targetDir: str, folderLayout: str, mode: RelayoutMode):
+        self.sourceIndex = sourceIndex
+        self.targetDir = targetDir
+        self.folderLayout = folderLayout
+        self.inPlace = os.path.normcase(os.path.abspath(sourceIndex.outputDir)) == os.path.normcase(os.path.abspath(targetDir))
+        # Hardlinks within the same archive would leave every document twice
+        self.mode = RelayoutMode.move if self.inPlace else mode
+
+    def plan(self) -> list[tuple[IndexEntry, str]]:
+        """
+        New relative path for every indexed document whose file exists, in index order.
+        """
+        if self.inPlace:
+            # Indexed files are moved away, so only foreign files block names
+            ignorePath = lambda path: self.sourceIndex.ownerOfPath(path) is not None
+        else:
+            ignorePath = None
+        # Always append suffixes: unlike a download, no existing file may be dropped
+        resolver = TargetPathResolver(self.targetDir, self.folderLayout, True, ignorePath)
+        moves = []
+        for documentId in list(self.sourceIndex.entries):
+            entry = self.sourceIndex.entries[documentId]
+            if not os.path.isfile(self.sourceIndex.absPath(entry.path)):
+                continue
+            newPath, _ = resolver.resolve(entry.name, entry.dateCreation, entry.mimeType)
+            moves.append((entry, newPath))
+        return moves
+
+    def execute(self, moves: list[tuple[IndexEntry, str]]) -> dict[str, int]:
+        """
+        The index is updated right after every file operation and saved regularly and on errors,
+        so an aborted run leaves every file either at its old or at its new, indexed place.
+        """
+        counts = {"total": len(moves), "moved": 0, "unchanged": 0, "copied": 0, "failed": 0}
+        targetIndex = self.sourceIndex if self.inPlace else LocalIndex(self.targetDir)
+        # Directories files were moved out of; only these are removed if they end up empty
+        self.__leftDirs: set[str] = set()
+        try:
+            if self.inPlace:
+                self.__executeInPlace(moves, counts)
+            else:
+                for entry, newPath in moves:
+                    try:
+                        self.__makeDirs(targetIndex.absPath(newPath))
+                        counts[self.__transfer(self.sourceIndex.absPath(entry.path), targetIndex.absPath(newPath))] += 1
+                    except OSError:
+                        counts["failed"] += 1
+                        continue
+                    targetIndex.set(self.__movedEntry(entry, newPath))
+                    if self.mode == RelayoutMode.move:
+                        self.__leftDirs.add(os.path.dirname(self.sourceIndex.absPath(entry.path)))
+                        self.sourceIndex.remove(entry.documentId)
+                    self.__saveRegularly(counts, targetIndex)
+        finally:
+            targetIndex.save()
+            if not self.inPlace and self.mode == RelayoutMode.move:
+                self.sourceIndex.save()
+            self.__removeEmptyDirs()
+        return counts
+
+    def __executeInPlace(self, moves: list[tuple[IndexEntry, str]], counts: dict[str, int]):
+        """
+        Renames every file directly to its new name. Only if files block each other in a cycle,
+        one of them is first renamed next to its old place; the index always points to the current name.
+        """
+        # source path key -> [entry, current path, new path]
+        pending: dict[str, list] = {}
+        for entry, newPath in moves:
+            if entry.path == newPath:
+                counts["unchanged"] += 1
+            else:
+                pending[pathKey(entry.path)] = [entry, entry.path, newPath]
+
+        while pending:
+            progressed = False
+            for key in list(pending):
+                entry, currentPath, newPath = pending[key]
+                if pathKey(newPath) in pending and pathKey(newPath) != key:
+                    # the target is still occupied by a file which moves later
+                    continue
+                del pending[key]
+                progressed = True
+                source = self.sourceIndex.absPath(currentPath)
+                target = self.sourceIndex.absPath(newPath)
+                try:
+                    # never overwrite; a rename that only changes the case is fine
+                    if pathKey(currentPath) != pathKey(newPath) and os.path.exists(target):
+                        raise FileExistsError(target)
+                    self.__makeDirs(target)
+                    os.rename(source, target)
+                except OSError:
+                    counts["failed"] += 1
+                    continue
+                self.__leftDirs.add(os.path.dirname(source))
+                self.sourceIndex.set(self.__movedEntry(entry, newPath))
+                counts["moved"] += 1
+                self.__saveRegularly(counts, self.sourceIndex)
+            if not progressed:
+                # Cycle: rename one file to a free name beside it, which frees its old name for the others
+                key = next(iter(pending))
+                entry, currentPath, newPath = pending.pop(key)
+                parkedPath = f"{currentPath}.relayout"
+                try:
+                    os.rename(self.sourceIndex.absPath(currentPath), self.sourceIndex.absPath(parkedPath))
+                except OSError:
+                    counts["failed"] += 1
+                    continue
+                self.sourceIndex.set(self.__movedEntry(entry, parkedPath))
+                pending[pathKey(parkedPath)] = [entry, parkedPath, newPath]
+
+    def __movedEntry(self, entry: IndexEntry, newPath: str) -> IndexEntry:
+        return IndexEntry(entry.documentId, newPath, entry.name, entry.dateCreation, entry.mimeType, entry.size, entry.objectKey, entry.sha256, entry.fingerprint)
+
+    def __saveRegularly(self, counts: dict[str, int], index: LocalIndex):
+        if (counts["moved"] + counts["copied"]) % self.saveIndexEvery == 0:
+            index.save()
+
+    def __transfer(self, source: str, target: str) -> str:
+        try:
+            if self.mode == RelayoutMode.hardlink:
+                os.link(source, target)
+            else:
+                os.rename(source, target)
+            return "moved"
+        except OSError:
+            # Different file systems: neither rename nor hardlink are possible
+            shutil.copy2(source, target)
+            if self.mode == RelayoutMode.move:
+                os.remove(source)
+            return "copied"
+
+    def __makeDirs(self, filepath: str):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    def __removeEmptyDirs(self):
+        outputDir = os.path.abspath(self.sourceIndex.outputDir)
+        # deepest first, then up the parents as long as they became empty as well
+        for directory in sorted(self.__leftDirs, key=len, reverse=True):
+            directory = os.path.abspath(directory)
+            while directory.startswith(outputDir + os.sep) and os.path.isdir(directory) and not os.listdir(directory):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+
@@ -0,0 +1,182 @@
+import json
+import sys
+import time
+from enum import Enum
+from typing import TextIO
+from rich.console import Console
+from rich.progress import (
+    BarColumn,
+    Progress,
+    TextColumn,
+    TimeRemainingColumn,
+    TaskProgressColumn
+)
+from pathvalidate._filename import sanitize_filename
+from ComdirectConnection import Document
+from DownloadPlan import PlanEntry
+
+
+class OutputMode(Enum):
+    rich = "rich"
+    compact = "compact"
+    quiet = "quiet"
+    json = "json"
+
+
+class StatusKind(Enum):
+    downloaded = "downloaded"
+    skipped = "skipped"
+    error = "error"
+    info = "info"
+
+
+class StatusRenderer:
+    """
+    Receives the per-document status events of the download executor and the archive verification.
+    The base renderer discards all events; it is used for the quiet output mode.
+    """
+    total: int
+
+    def __init__(self, total: int):
+        self.total = total
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def advance(self, steps: int = 1):
+        pass
+
+    def status(self, idx: int, document: Document | PlanEntry, kind: StatusKind, message: str = ""):
+        pass
+
+    def summary(self, counts: dict[str, int]):
+        pass
+
+
+class RichStatusRenderer(StatusRenderer):
+    """
+    Interactive progress bar. Status lines and progress updates are buffered and written to the console
+    at most `refreshPerSecond` times per second instead of once per document.
+    """
+    refreshPerSecond: float = 4
+
+    def __init__(self, total: int, console: Console, width: int, description: str = "Downloading..."):
+        super().__init__(total)
+        self.console = console
+        self.width = width
+        self.description = description
+        self.progress = Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(bar_width=150),
+            TaskProgressColumn(),
+            TimeRemainingColumn(),
+            console=console,
+            refresh_per_second=self.refreshPerSecond,
+        )
+        self.__lines: list[str] = []
+        self.__pendingSteps = 0
+        self.__nextFlush = 0.0
+
+    def start(self):
+        self.progress.start()
+        self.task = self.progress.add_task(self.description, total=self.total)
+        self.__nextFlush = time.monotonic() + 1 / self.refreshPerSecond
+
+    def stop(self):
+        self.__flush()
+        self.progress.stop()
+
+    def advance(self, steps: int = 1):
+        self.__pendingSteps += steps
+        self.__flushIfDue()
+
+    def status(self, idx: int, document: Document | PlanEntry, kind: StatusKind, message: str = ""):
+        printLeftString = f"{str(idx):>5} | [cyan]{document.dateCreation.strftime('%Y-%m-%d')}[/cyan] | {sanitize_filename(document.name)}"
+        spaces = self.width - len(printLeftString) - len(message)
+        self.__lines.append(printLeftString + (spaces * " ") + message)
+        self.__flushIfDue()
+
+    def __flushIfDue(self):
+        if time.monotonic() >= self.__nextFlush:
+            self.__flush()
+            self.__nextFlush = time.monotonic() + 1 / self.refreshPerSecond
+
+    def __flush(self):
+        if self.__lines:
+            self.progress.console.print("\n".join(self.__lines), highlight=False)
+            self.__lines = []
+        if self.__pendingSteps:
+            self.progress.advance(self.task, self.__pendingSteps)
+            self.__pendingSteps = 0
+
+
+class CompactStatusRenderer(StatusRenderer):
+    """
+    One unpadded, tab-separated line per event without markup or progress bar. Suited for piping into files.
+    """
+
+    def __init__(self, total: int, stream: TextIO = sys.stdout):
+        super().__init__(total)
+        self.stream = stream
+
+    def stop(self):
+        self.stream.flush()
+
+    def status(self, idx: int, document: Document | PlanEntry, kind: StatusKind, message: str = ""):
+        self.stream.write(f"{idx}\t{document.dateCreation.strftime('%Y-%m-%d')}\t{document.name}\t{kind.value}\t{message}\n")
+
+
+class JsonStatusRenderer(RichStatusRenderer):
+    """
+    Shows only the progress bar on the console and appends every event as a JSON line to the log file.
+    """
+
+    def __init__(self, total: int, console: Console, width: int, logFile: str, description: str = "Downloading..."):
+        super().__init__(total, console, width, description)
+        self.logFile = logFile
+
+    def start(self):
+        self.log = open(self.logFile, "a", encoding="utf-8")
+        super().start()
+
+    def stop(self):
+        super().stop()
+        self.log.close()
+
+    def status(self, idx: int, document: Document | PlanEntry, kind: StatusKind, message: str = ""):
+        self.log.write(json.dumps({
+            "time": time.time(),
+            "idx": idx,
+            "documentId": document.documentId,
+            "dateCreation": document.dateCreation.strftime("%Y-%m-%d"),
+            "name": document.name,
+            "mimeType": document.mimeType,
+            "kind": kind.value,
+            "message": message,
+        }, ensure_ascii=False) + "\n")
+
+    def summary(self, counts: dict[str, int]):
+        with open(self.logFile, "a", encoding="utf-8") as log:
+            log.write(json.dumps({"time": time.time(), "kind": "summary", **counts}, ensure_ascii=False) + "\n")
+
+
+def createStatusRenderer(outputMode: str, total: int, console: Console, width: int, logFile: str, description: str = "Downloading...") -> StatusRenderer:
+    if outputMode == OutputMode.rich.value:
+        return RichStatusRenderer(total, console, width, description)
+    elif outputMode == OutputMode.compact.value:
+        return CompactStatusRenderer(total)
+    elif outputMode == OutputMode.quiet.value:
+        return StatusRenderer(total)
+    elif outputMode == OutputMode.json.value:
+        return JsonStatusRenderer(total, console, width, logFile, description)
+    raise NameError(f"Unknown outputMode {outputMode}")
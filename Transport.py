@@ -0,0 +1,192 @@
+import atexit
+import base64
+import gzip
+import json
+import threading
+import time
+from enum import Enum
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Values of these keys are replaced by placeholders before anything is written to a cassette
+sensitiveKeys = ["access_token", "refresh_token", "kdnr", "bpid", "kontaktId", "identifier", "challenge", "id", "sessionId", "requestId"]
+# Only these response headers are recorded
+recordedHeaders = ["content-type", "x-once-authentication-info"]
+
+
+class TransportMode(Enum):
+    live = "live"
+    record = "record"
+    replay = "replay"
+
+
+class CassetteBodies(Enum):
+    # store document bodies completely
+    full = "full"
+    # only store the size of document bodies, replay serves placeholder bytes of that size
+    stub = "stub"
+
+
+class Transport:
+    """
+    Sends the HTTP requests of a Connection. The live transport simply uses requests.
+    """
+
+    def request(self, method: str, url: str, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url: str, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def close(self):
+        pass
+
+
+class RecordingTransport(Transport):
+    """
+    Live transport that additionally appends every exchange with its latency to a gzip compressed cassette (JSON lines)
+    as soon as it is answered, so long recordings do not pile up in memory.
+    Tokens, session identifiers and TAN challenges are replaced by placeholders, request headers and bodies are never stored.
+    """
+
+    def __init__(self, cassetteFile: str, bodies: CassetteBodies = CassetteBodies.full):
+        self.cassetteFile = cassetteFile
+        self.bodies = bodies
+        self.__placeholders: dict[str, str] = {}
+        self.__lock = threading.Lock()
+        self.__file = gzip.open(cassetteFile, "wt", encoding="utf-8")
+        atexit.register(self.close)
+
+    def request(self, method: str, url: str, **kwargs):
+        start = time.monotonic()
+        r = super().request(method, url, **kwargs)
+        latency = time.monotonic() - start
+        with self.__lock:
+            self.__file.write(json.dumps(self.__sanitize(method, url, r, latency), ensure_ascii=False) + "\n")
+        return r
+
+    def close(self):
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.close()
+
+    def __sanitize(self, method: str, url: str, r: requests.Response, latency: float) -> dict[str, object]:
+        headers = {}
+        for key in recordedHeaders:
+            if key in r.headers:
+                headers[key] = r.headers[key]
+        if "x-once-authentication-info" in headers:
+            # The challenge may contain a phone number or a photoTAN graphic. Replays always ask for a PushTAN confirmation.
+            info = json.loads(headers["x-once-authentication-info"])
+            headers["x-once-authentication-info"] = json.dumps({"id": self.__placeholder("id", str(info.get("id", ""))), "typ": "P_TAN_PUSH", "availableTypes": ["P_TAN_PUSH"]})
+        record = {
+            "method": method,
+            "url": self.__sanitizeText(url),
+            "status": r.status_code,
+            "headers": headers,
+            "latency": round(latency, 4),
+        }
+        if "json" in r.headers.get("content-type", ""):
+            try:
+                record["json"] = self.__sanitizeJson(r.json())
+            except ValueError:
+                record["body"] = base64.b64encode(r.content).decode("ascii")
+        elif self.bodies == CassetteBodies.full:
+            record["body"] = base64.b64encode(r.content).decode("ascii")
+        else:
+            record["bodySize"] = len(r.content)
+        return record
+
+    def __placeholder(self, key: str, value: str) -> str:
+        if value not in self.__placeholders:
+            self.__placeholders[value] = f"{key}-{len(self.__placeholders) + 1}"
+        return self.__placeholders[value]
+
+    def __sanitizeJson(self, data: object) -> object:
+        if isinstance(data, dict):
+            return {key: self.__placeholder(key, str(value)) if key in sensitiveKeys and value else self.__sanitizeJson(value) for key, value in data.items()}
+        elif isinstance(data, list):
+            return [self.__sanitizeJson(x) for x in data]
+        return data
+
+    def __sanitizeText(self, text: str) -> str:
+        for value, placeholder in self.__placeholders.items():
+            # Short values would also match unrelated parts of the url
+            if len(value) >= 6:
+                text = text.replace(value, placeholder)
+        return text
+
+
+class ReplayResponse:
+    """
+    Minimal stand-in for requests.Response, as far as Connection uses it.
+    """
+
+    def __init__(self, method: str, url: str, record: dict[str, object]):
+        self.url = url
+        self.method = method
+        self.status_code = record["status"]
+        self.headers = CaseInsensitiveDict(record["headers"])
+        if "json" in record:
+            self.content = json.dumps(record["json"]).encode("utf-8")
+        elif "body" in record:
+            self.content = base64.b64decode(record["body"])
+        else:
+            self.content = b"%PDF-replay-stub\n".ljust(record["bodySize"], b"\0")
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error (replay) for url: {self.url}", response=self)
+
+
+class ReplayTransport(Transport):
+    """
+    Serves the exchanges of a cassette instead of contacting the bank. Requests are matched by method and url;
+    repeated requests are answered in recorded order. Latencies are reproduced, multiplied by latencyScale (0 = no delay).
+    """
+
+    def __init__(self, cassetteFile: str, latencyScale: float = 1.0):
+        self.latencyScale = latencyScale
+        self.__records: dict[tuple[str, str], list[dict[str, object]]] = {}
+        self.__lock = threading.Lock()
+        with gzip.open(cassetteFile, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.__records.setdefault((record["method"], record["url"]), []).append(record)
+
+    def request(self, method: str, url: str, **kwargs):
+        with self.__lock:
+            records = self.__records.get((method, url))
+            if not records:
+                raise NameError(f"Keine Aufzeichnung für {method} {url} in der Kassette")
+            # The last answer for a url stays available for further identical requests
+            record = records.pop(0) if len(records) > 1 else records[0]
+        if self.latencyScale > 0:
+            time.sleep(record["latency"] * self.latencyScale)
+        return ReplayResponse(method, url, record)
+
+
+def createTransport(mode: str, cassetteFile: str, bodies: str, latencyScale: float) -> Transport:
+    if mode == TransportMode.live.value:
+        return Transport()
+    elif mode == TransportMode.record.value:
+        return RecordingTransport(cassetteFile, CassetteBodies(bodies))
+    elif mode == TransportMode.replay.value:
+        return ReplayTransport(cassetteFile, latencyScale)
+    raise NameError(f"Unknown transportMode {mode}")
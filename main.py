@@ -3,18 +3,17 @@
 import json
 from ComdirectConnection import Connection, Document, XOnceAuthenticationInfo
 from settings import Settings
-from pathvalidate._filename import sanitize_filename
-from enum import Enum
+from StatusRenderer import createStatusRenderer
+from LocalIndex import LocalIndex
+from DownloadPlan import DownloadPlan, DownloadPlanner, PlanAction, legacyFolderLayout
+from DownloadExecutor import DownloadExecutor
+from ArchiveVerify import ArchiveVerifier
+from OutputSink import LocalSink, ObjectStoreSink, SinkMode
+from Transport import TransportMode, createTransport
+from Relayout import ArchiveMatcher, Relayout, RelayoutMode
 from rich.console import Console
 from rich.table import Table
 from rich.prompt import IntPrompt
-from rich.progress import (
-    BarColumn,
-    Progress,
-    TextColumn,
-    TimeRemainingColumn,
-    TaskProgressColumn
-)
 import os
 
 ui_width=  200
@@ -29,12 +28,6 @@ def print(string: object, highlight : bool | None = None):
     console.print(string, highlight=highlight)
 
 
-class DownloadSource(Enum):
-    archivedOnly = "archivedOnly"
-    notArchivedOnly = "notArchivedOnly"
-    all = "all"
-
-
 class Main:
     conn: Connection
     onlineDocumentsDict: dict[int, Document] = {}
@@ -76,6 +69,10 @@ class Main:
             table.add_row("(2)", "Einstellungen neu aus Datei laden")
             table.add_row("(3)", "Status verfügbarer Dateien anzeigen (online)")
             table.add_row("(4)", "Verfügbare Dateien herunterladen (online)")
+            table.add_row("(5)", "Downloadplan erstellen und anzeigen (online)")
+            table.add_row("(6)", "Gespeicherten Downloadplan ausführen")
+            table.add_row("(7)", "Vorhandenes Archiv neu anordnen (Ordnerstruktur/Zielverzeichnis)")
+            table.add_row("(8)", "Vorhandenes Archiv prüfen (Prüfsummen)")
             table.add_row("(0)", "Beenden")
 
             print(header)
@@ -88,7 +85,7 @@ class Main:
 
         while loop:
             __print_menu()
-            val = IntPromptDeutsch.ask("Wählen Sie eine Aktion", choices=["1", "2", "3", "4", "0"])
+            val = IntPromptDeutsch.ask("Wählen Sie eine Aktion", choices=["1", "2", "3", "4", "5", "6", "7", "8", "0"])
 
             if val == 1:
                 # Show Current Settings
@@ -98,7 +95,7 @@ class Main:
                 settings = self.settings.getSettings()
                 for key in settings:
                     value = settings[key]
-                    if key in ["clientsecret", "pwd"]:
+                    if key in ["clientsecret", "pwd", "s3secretkey"]:
                         value = "******"
                     tSettings.add_row(key, value)
                 console.print(tSettings)
@@ -116,6 +113,20 @@ class Main:
                 self.__startConnection()
                 self.__loadDocuments()
                 self.__processOnlineDocuments()
+            elif val == 5:
+                # compute the download plan without downloading
+                self.__startConnection()
+                self.__loadDocuments()
+                self.__writePlan()
+            elif val == 6:
+                # execute a previously written download plan
+                self.__processPlanFile()
+            elif val == 7:
+                # move existing files into the current layout
+                self.__relayoutArchive()
+            elif val == 8:
+                # check the local files against the recorded hashes
+                self.__verifyArchive()
             elif val == 0:
                 loop = False
 
@@ -136,6 +147,7 @@ class Main:
             password=self.settings.getValueForKey("pwd"),
             client_id=self.settings.getValueForKey("clientId"),
             client_secret=self.settings.getValueForKey("clientSecret"),
+            transport=self.__createTransport(),
         )
 
         attempts = 0
@@ -190,6 +202,22 @@ class Main:
             break
         print("Login erfolgreich!")
 
+    def __createTransport(self):
+        cassetteFile = self.settings.getValueForKey("cassetteFile")
+        if not os.path.isabs(cassetteFile):
+            cassetteFile = os.path.join(self.dirname, cassetteFile)
+        transportMode = self.settings.getValueForKey("transportMode")
+        if transportMode == TransportMode.record.value:
+            print(f"[i][cyan]Aufnahmemodus: Die Antworten der API werden bereinigt nach {cassetteFile} geschrieben.")
+        elif transportMode == TransportMode.replay.value:
+            print(f"[i][cyan]Wiedergabemodus: Die Antworten der API werden aus {cassetteFile} wiedergegeben.")
+        return createTransport(
+            transportMode,
+            cassetteFile,
+            self.settings.getValueForKey("cassetteBodies"),
+            float(self.settings.getValueForKey("replayLatencyScale")),
+        )
+
     def __loadDocuments(self):
         if not hasattr(self, "conn"):
             raise NameError("conn not set!")
@@ -226,7 +254,22 @@ class Main:
         self.countOnlineAll = len(self.onlineDocumentsDict)
 
         # do the count run!
-        self.__processOnlineDocuments(True)
+        downloadFilenameList = self.settings.getValueForKey("downloadOnlyFilenamesArray")
+        for idx in self.onlineDocumentsDict:
+            document = self.onlineDocumentsDict[idx]
+            if document.advertisement:
+                self.onlineAdvertismentIndicesList.append(idx)
+            if document.documentMetadata.archived:
+                self.onlineArchivedIndicesList.append(idx)
+            if document.name.split(" ", 1)[0] in downloadFilenameList:
+                self.onlineFileNameMatchingIndicesList.append(idx)
+            if not document.documentMetadata.alreadyRead:
+                self.onlineUnreadIndicesList.append(idx)
+        for entry in self.__createPlan().entries:
+            if entry.action in [PlanAction.skipExisting, PlanAction.upload]:
+                self.onlineAlreadyDownloadedIndicesList.append(entry.idx)
+            elif entry.needsDownload():
+                self.onlineNotYetDownloadedIndicesList.append(entry.idx)
 
         # show result:
         table = Table(width= int(ui_width / 2))
@@ -243,166 +286,193 @@ class Main:
             table.add_row("Davon in der Liste gewünschter Dateinamen", str(len(self.onlineFileNameMatchingIndicesList)), style="dim")
         print(table)
 
-    def __processOnlineDocuments(self, isCountRun: bool = False):
+    def __getLocalIndex(self):
+        if not hasattr(self, "localIndex") or self.localIndex.outputDir != self.settings.outputDir:
+            self.localIndex = LocalIndex(self.settings.outputDir)
+        return self.localIndex
+
+    def __getPlanFile(self):
+        planFile = self.settings.getValueForKey("planFile")
+        if not os.path.isabs(planFile):
+            planFile = os.path.join(self.settings.outputDir, planFile)
+        return planFile
+
+    def __getFolderLayout(self):
+        try:
+            return self.settings.getValueForKey("folderLayout")
+        except NameError:
+            # not set, fall back to useSubFolders
+            return legacyFolderLayout(self.settings.getBoolValueForKey("useSubFolders"))
+
+    def __getSinkMode(self):
+        return SinkMode(self.settings.getValueForKey("outputSink"))
+
+    def __createObjectSink(self):
+        return ObjectStoreSink(
+            endpoint=self.settings.getSettings().get("s3Endpoint", ""),
+            bucket=self.settings.getValueForKey("s3Bucket"),
+            accessKey=self.settings.getValueForKey("s3AccessKey"),
+            secretKey=self.settings.getValueForKey("s3SecretKey"),
+            region=self.settings.getSettings().get("s3Region", ""),
+            prefix=self.settings.getSettings().get("s3Prefix", ""),
+            uploadThreads=int(self.settings.getValueForKey("s3UploadThreads")),
+            multipartChunkMB=int(self.settings.getValueForKey("s3MultipartChunkMB")),
+        )
+
+    def __createPlan(self):
+        planner = DownloadPlanner(
+            self.__getLocalIndex(),
+            folderLayout=self.__getFolderLayout(),
+            appendIfNameExists=self.settings.getBoolValueForKey("appendIfNameExists"),
+            downloadOnlyFilenames=self.settings.getBoolValueForKey("downloadOnlyFilenames"),
+            downloadFilenameList=self.settings.getValueForKey("downloadOnlyFilenamesArray"),
+            downloadSource=self.settings.getValueForKey("downloadSource"),
+            storeLocal=self.__getSinkMode() != SinkMode.s3,
+            storeObject=self.__getSinkMode() != SinkMode.local,
+        )
+        return planner.plan(self.onlineDocumentsDict)
+
+    def __writePlan(self):
         if not self.onlineDocumentsDict:
             return
+        plan = self.__createPlan()
+        plan.save(self.__getPlanFile())
+        print(f"[i][cyan]Downloadplan wurde nach {self.__getPlanFile()} geschrieben.")
+        self.__executePlan(plan, dryRun=True)
 
-        def __printStatus(idx: int, document: Document, status: str = ""):
-            # fill idx to 5 chars
-            if isCountRun:
-                return
-            printLeftString = f"{str(idx):>5} | [cyan]{document.dateCreation.strftime('%Y-%m-%d')}[/cyan] | {sanitize_filename(document.name)}"
-            printRightString = status
-            filler: str = " "
-            spaces = ui_width - len(printLeftString) - len(printRightString)
-            if isinstance(console, Console):
-                progress.console.print(printLeftString + (spaces * filler) + printRightString, highlight=False)
-            else:
-                print(printLeftString + (spaces * filler) + printRightString, highlight=False)
-
-        def __isFileEqual(filepath : str, newdata : bytes):
-            with open(filepath, 'rb') as f:
-                data = f.read()
-                return data == newdata
-        progress = Progress(
-            TextColumn("[progress.description]{task.description}"),
-            BarColumn( bar_width= 150 ),
-            TaskProgressColumn(),
-            TimeRemainingColumn(),
-            console = console,
-            transient=isCountRun
-        )
-        with progress:
-            overwrite = False  # Only download new files
-            useSubFolders = self.settings.getBoolValueForKey("useSubFolders")
-            outputDir = self.settings.getValueForKey("outputDir")
-            downloadFilenameList = self.settings.getValueForKey("downloadOnlyFilenamesArray")
-            downloadSource = self.settings.getValueForKey("downloadSource")
-
-            countAll = len(self.onlineDocumentsDict)
-            countProcessed = 0
-            countSkipped = 0
-            countDownloaded = 0
-
-            task =progress.add_task("Downloading...",total=countAll)
-            # for idx in range(len(self.onlineDocumentsDict)): # documentMeta in enumerate(self.onlineDocumentsDict):
-            for idx in self.onlineDocumentsDict:
-                progress.advance(task)
-                document = self.onlineDocumentsDict[idx]
-                firstFilename = document.name.split(" ", 1)[0]
-                subFolder = ""
-                myOutputDir = outputDir
-                countProcessed += 1
-
-                # counting
-                if document.advertisement:
-                    self.onlineAdvertismentIndicesList.append(idx)
-                if document.documentMetadata.archived:
-                    self.onlineArchivedIndicesList.append(idx)
-                if firstFilename in downloadFilenameList:
-                    self.onlineFileNameMatchingIndicesList.append(idx)
-                if not document.documentMetadata.alreadyRead:
-                    self.onlineUnreadIndicesList.append(idx)
-
-                # check for setting "download source"
-                if downloadSource == DownloadSource.archivedOnly.value and not document.documentMetadata.archived or downloadSource == DownloadSource.notArchivedOnly.value and document.documentMetadata.archived:
-                    __printStatus(idx, document, "SKIPPED - not in selected download source")
-                    countSkipped += 1
-                    continue
-
-                # check for setting "only download if filename is in filename list"
-                if self.settings.getBoolValueForKey("downloadOnlyFilenames") and not firstFilename in downloadFilenameList:
-                    __printStatus(idx, document, "SKIPPED - filename not in filename list")
-                    countSkipped += 1
-                    continue
-                filename = document.name
-                if document.mimeType == "application/pdf":
-                    subFolder = "pdf"
-                    filename += ".pdf"
-                elif document.mimeType == "text/html":
-                    subFolder = "html"
-                    filename += ".html"
-                else:
-                    __printStatus(idx, document, f"Unknown mimeType {document.mimeType}")
-
-                if useSubFolders:
-                    myOutputDir : str = os.path.join(outputDir, sanitize_filename(subFolder))
-                    if not os.path.exists(myOutputDir):
-                        os.makedirs(myOutputDir)
-
-                filepath = os.path.join(myOutputDir, sanitize_filename(filename))
-
-                # do the download
-                if bool(self.settings.getBoolValueForKey("dryRun")) or isCountRun:
-                    __printStatus(idx, document, "HERUNTERGELADEN - Testlauf, kein tatsächlicher Download")
-                    countDownloaded += 1
-                    continue
-
-                docDate = document.dateCreation.timestamp()
-                docContent = None
-
-                # check if already downloaded
-                if os.path.exists(filepath):
-                    if (self.settings.getBoolValueForKey("appendIfNameExists")):
-                        if (docDate!= os.path.getmtime(filepath)): # If not the same, we simply append the date
-                            # print(document.name)
-                            # print(f"{docDate} {document.dateCreation.strftime("%Y-%m-%d")}")
-                            # print(filepath)
-                            # print(f"{os.path.getmtime(filepath)} {datetime.fromtimestamp(os.path.getmtime(filepath)).strftime("%Y-%m-%d")}")
-                            path, suffix = filepath.rsplit(".",1)
-                            filepath = f"{path}_{document.dateCreation.strftime('%Y-%m-%d')}.{suffix}"
-                            # print("New filepath" + filepath)
-                        if os.path.exists(filepath): # If there's multiple per same day, we append a counter
-                            docContent = self.conn.downloadDocument(document) # Gotta load early to check if content is same
-                            if docContent is None:
-                                __printStatus(idx, document, "FEHLER - Download fehlgeschlagen (siehe oben)")
-                                countSkipped += 1
-                                continue
-                            if __isFileEqual(filepath, docContent):
-                                __printStatus(idx, document, "ÜBERSPRUNGEN - Datei bereits heruntergeladen")
-                                countSkipped += 1
-                                self.onlineAlreadyDownloadedIndicesList.append(idx)
-                                continue
-                            path, suffix = filepath.rsplit(".",1)
-                            counter = 1
-                            while(os.path.exists(filepath)):
-                                filepath = f"{path}_{counter}.{suffix}"
-                                counter += 1 # We increase the counter by 1
-                            # print("New filepath" + filepath)
-                            if os.path.exists(filepath): # Enough is enough...
-                                __printStatus(idx, document, "ÜBERSPRUNGEN - Datei bereits heruntergeladen")
-                                self.onlineNotYetDownloadedIndicesList.append(idx)
-                                continue
-                    elif not overwrite:
-                        __printStatus(idx, document, "ÜBERSPRUNGEN - appendIfNameExists ist FALSE")
-                        countSkipped += 1
-                        self.onlineAlreadyDownloadedIndicesList.append(idx)
-                        continue
-                if not docContent: # Ensure data is loaded
-                    docContent = self.conn.downloadDocument(document)
-                if docContent is None:
-                    __printStatus(idx, document, "FEHLER - Download fehlgeschlagen (siehe oben)")
-                    countSkipped += 1
-                    continue
-                with open(filepath, "wb") as f:
-                    f.write(docContent)
-                    # shutil.copyfileobj(docContent, f)
-                os.utime(filepath, (docDate, docDate))
-                __printStatus(idx, document, "HERUNTERGELADEN")
-                countDownloaded += 1
-
-            # last line, summary status:
-            if not isCountRun:
-                table = Table(width= int(ui_width / 2))
-                table.add_column("Zusammenfassung", no_wrap=True, ratio = 999)
-                table.add_column("Anzahl", style="blue b", width = 10, justify="right")
-                table.add_row("Dokumente gesamt", str(countAll))
-                table.add_section()
-                table.add_row("Davon verarbeitet", str(countProcessed))
-                table.add_row("Davon heruntergeladen", str(countDownloaded))
-                table.add_row("Davon übersprungen", str(countSkipped), style="dim")
-                print(table)
-
-
-dirname = os.path.dirname(__file__)
-main = Main(dirname)
+    def __processOnlineDocuments(self):
+        if not self.onlineDocumentsDict:
+            return
+        plan = self.__createPlan()
+        plan.save(self.__getPlanFile())
+        self.__executePlan(plan, bool(self.settings.getBoolValueForKey("dryRun")))
+
+    def __processPlanFile(self):
+        planFile = self.__getPlanFile()
+        if not os.path.isfile(planFile):
+            print(f"[red]Kein Downloadplan unter {planFile} gefunden.")
+            return
+        plan = DownloadPlan.load(planFile)
+        if plan.outputDir != self.settings.outputDir:
+            print(f"[red]Der Downloadplan wurde für das Zielverzeichnis {plan.outputDir} erstellt, eingestellt ist {self.settings.outputDir}.")
+            return
+        if self.__getSinkMode() == SinkMode.local and plan.count(PlanAction.upload):
+            print(f"[red]Der Downloadplan enthält {plan.count(PlanAction.upload)} Uploads, eingestellt ist outputSink = {SinkMode.local.value}.")
+            return
+        if any(entry.needsDownload() for entry in plan.entries):
+            self.__startConnection()
+        self.__executePlan(plan, bool(self.settings.getBoolValueForKey("dryRun")))
+
+    def __executePlan(self, plan: DownloadPlan, dryRun: bool):
+        logFile = self.settings.getValueForKey("logFile")
+        if not os.path.isabs(logFile):
+            logFile = os.path.join(self.dirname, logFile)
+        renderer = createStatusRenderer(self.settings.getValueForKey("outputMode"), len(plan.entries), console, ui_width, logFile, "Downloading...")
+        sinkMode = self.__getSinkMode()
+        localSink = LocalSink(self.__getLocalIndex()) if sinkMode != SinkMode.s3 else None
+        objectSink = self.__createObjectSink() if sinkMode != SinkMode.local and not dryRun else None
+        executor = DownloadExecutor(getattr(self, "conn", None), self.__getLocalIndex(), int(self.settings.getValueForKey("downloadThreads")), localSink, objectSink)
+        with renderer:
+            counts = executor.execute(plan, renderer, dryRun)
+
+        # last line, summary status:
+        renderer.summary(counts)
+        table = Table(width= int(ui_width / 2))
+        table.add_column("Zusammenfassung", no_wrap=True, ratio = 999)
+        table.add_column("Anzahl", style="blue b", width = 10, justify="right")
+        table.add_row("Dokumente gesamt", str(counts["total"]))
+        table.add_section()
+        table.add_row("Davon verarbeitet", str(counts["processed"]))
+        table.add_row("Davon heruntergeladen", str(counts["downloaded"]))
+        table.add_row("Davon übersprungen", str(counts["skipped"]), style="dim")
+        print(table)
+
+    def __relayoutArchive(self):
+        def __isYes(answer: str):
+            return answer.lower() in ["ja", "j", "yes", "y"]
+
+        targetDir = self.settings.outputDir
+        sourceDir = console.input(f"Bisheriges Archivverzeichnis [dim]({targetDir})[/dim]: ") or targetDir
+        if not os.path.isabs(sourceDir):
+            sourceDir = os.path.join(self.dirname, sourceDir)
+        if not os.path.isdir(sourceDir):
+            print(f"[red]Verzeichnis {sourceDir} nicht gefunden.")
+            return
+        sourceIndex = self.__getLocalIndex() if os.path.samefile(sourceDir, targetDir) else LocalIndex(sourceDir)
+
+        unindexedFiles = sourceIndex.findUnindexedFiles()
+        if unindexedFiles:
+            print(f"{len(unindexedFiles)} Dateien sind noch keinem Online-Dokument zugeordnet. Für die einmalige Zuordnung wird die Online-Dokumentliste benötigt.")
+            if __isYes(console.input("Jetzt anmelden und zuordnen? (ja/nein): ")):
+                self.__startConnection()
+                self.__loadDocuments()
+                matched = ArchiveMatcher(sourceIndex, self.conn).match(self.onlineDocumentsDict, unindexedFiles)
+                sourceIndex.save()
+                print(f"{matched} von {len(unindexedFiles)} Dateien wurden zugeordnet. Nicht zugeordnete Dateien bleiben unverändert liegen.")
+
+        relayout = Relayout(sourceIndex, targetDir, self.__getFolderLayout(), RelayoutMode(self.settings.getValueForKey("relayoutMode")))
+        if not relayout.inPlace and LocalIndex(targetDir).entries:
+            print(f"[red]Das Zielverzeichnis {targetDir} enthält bereits ein Archiv.")
+            return
+        moves = relayout.plan()
+        changes = [(entry, newPath) for entry, newPath in moves if not relayout.inPlace or entry.path != newPath]
+        if bool(self.settings.getBoolValueForKey("dryRun")):
+            for entry, newPath in changes:
+                print(f"TESTLAUF - {entry.path} -> {newPath}", highlight=False)
+        print(f"{len(changes)} von {len(moves)} Dateien werden nach {targetDir} übertragen ({relayout.mode.value}).")
+        if bool(self.settings.getBoolValueForKey("dryRun")) or not changes or not __isYes(console.input("Fortfahren? (ja/nein): ")):
+            return
+
+        counts = relayout.execute(moves)
+        self.localIndex = LocalIndex(targetDir)
+
+        table = Table(width= int(ui_width / 2))
+        table.add_column("Zusammenfassung", no_wrap=True, ratio = 999)
+        table.add_column("Anzahl", style="blue b", width = 10, justify="right")
+        table.add_row("Dokumente gesamt", str(counts["total"]))
+        table.add_section()
+        table.add_row("Davon verschoben/verlinkt", str(counts["moved"]))
+        table.add_row("Davon kopiert (anderes Dateisystem)", str(counts["copied"]))
+        table.add_row("Davon unverändert", str(counts["unchanged"]), style="dim")
+        table.add_row("Davon fehlgeschlagen (verbleiben am alten Ort)", str(counts["failed"]), style="red" if counts["failed"] else "dim")
+        print(table)
+
+    def __verifyArchive(self):
+        index = self.__getLocalIndex()
+        logFile = self.settings.getValueForKey("logFile")
+        if not os.path.isabs(logFile):
+            logFile = os.path.join(self.dirname, logFile)
+        renderer = createStatusRenderer(self.settings.getValueForKey("outputMode"), len(index.entries), console, ui_width, logFile, "Verifying...")
+        verifier = ArchiveVerifier(index, int(self.settings.getValueForKey("verifyProcesses")))
+        with renderer:
+            result = verifier.verify(renderer)
+
+        table = Table(width= int(ui_width / 2))
+        table.add_column("Zusammenfassung", no_wrap=True, ratio = 999)
+        table.add_column("Anzahl", style="blue b", width = 10, justify="right")
+        table.add_row("Dokumente im Index", str(len(index.entries)))
+        table.add_section()
+        table.add_row("Davon unverändert seit letzter Prüfung", str(result.unchanged), style="dim")
+        table.add_row("Davon geprüft und in Ordnung", str(result.verified))
+        table.add_row("Davon Prüfsumme erstmals erfasst", str(result.recorded))
+        table.add_row("Davon fehlend", str(len(result.missing)), style="red" if result.missing else "dim")
+        table.add_row("Davon beschädigt", str(len(result.corrupt)), style="red" if result.corrupt else "dim")
+        table.add_section()
+        table.add_row("Dateien ohne zugeordnetes Dokument", str(len(result.orphans)), style="dim")
+        print(table)
+        for path in result.orphans:
+            print(f"  [dim]ohne Zuordnung:[/dim] {path}", highlight=False)
+
+        repairPlan = result.repairPlan(index.outputDir)
+        if not repairPlan.entries:
+            return
+        if console.input(f"{len(repairPlan.entries)} fehlende/beschädigte Dokumente erneut herunterladen? (ja/nein): ").lower() not in ["ja", "j", "yes", "y"]:
+            return
+        self.__startConnection()
+        self.__executePlan(repairPlan, bool(self.settings.getBoolValueForKey("dryRun")))
+
+
+# The guard keeps the worker processes of the archive verification from starting the menu again
+if __name__ == "__main__":
+    dirname = os.path.dirname(__file__)
+    main = Main(dirname)
@@ -36,6 +36,24 @@ class Settings:
 
                 if not self.__config.has_option("", "dryRun"):
                     self.__config["DEFAULT"]["dryRun"] = str(self.__isTruthy(self.__getInputForString("Soll dies ein Testlauf sein (keine Dateien werden heruntergeladen)? [ja/nein]: ")))
+
+                # optional settings, which are not prompted for
+                self.__setDefaultIfNotInConfig("outputMode", "rich")
+                self.__setDefaultIfNotInConfig("logFile", "comdirect.log.jsonl")
+                self.__setDefaultIfNotInConfig("planFile", ".comdirect-plan.json")
+                self.__setDefaultIfNotInConfig("downloadThreads", "4")
+                self.__setDefaultIfNotInConfig("relayoutMode", "move")
+                self.__setDefaultIfNotInConfig("outputSink", "local")
+                self.__setDefaultIfNotInConfig("s3UploadThreads", "4")
+                self.__setDefaultIfNotInConfig("s3MultipartChunkMB", "8")
+                self.__setDefaultIfNotInConfig("verifyProcesses", "0")
+                self.__setDefaultIfNotInConfig("transportMode", "live")
+                self.__setDefaultIfNotInConfig("cassetteFile", "comdirect.cassette.jsonl.gz")
+                self.__setDefaultIfNotInConfig("cassetteBodies", "full")
+                self.__setDefaultIfNotInConfig("replayLatencyScale", "1.0")
+
+                if self.__config["DEFAULT"]["outputSink"] != "local" and not self.__isSettingNameFilledInConfig("s3SecretKey"):
+                    self.__config["DEFAULT"]["s3SecretKey"] = getpass.getpass(prompt="Bitte geben Sie den Secret Key für den S3-Speicher ein: ", stream=None)
             except Exception as error:
                 print("ERROR", error)
                 exit(-1)
@@ -51,7 +69,7 @@ class Settings:
     def showSettings(self):
         for key in self.__config["DEFAULT"]:
             output = key + ": "
-            if key in ["pwd", "clientsecret"]:
+            if key in ["pwd", "clientsecret", "s3secretkey"]:
                 pwOut = ""
                 for _ in range(len(self.__config["DEFAULT"][key])):
                     pwOut += "*"
@@ -81,6 +99,10 @@ class Settings:
             return False
         return True
 
+    def __setDefaultIfNotInConfig(self, settingName: str, value: str):
+        if not self.__isSettingNameFilledInConfig(settingName):
+            self.__config["DEFAULT"][settingName] = value
+
     def __getInputForString(self, printString: str):
         # print("----------------------------------------------------------------")
         inp = input(printString)